@@ -1,15 +1,27 @@
 from chalice import Chalice, Cron, ConvertToMiddleware
 from datadog_lambda.wrapper import datadog_lambda_wrapper
-from chalicelib import (
-    lamp,
-)
 
 app = Chalice(app_name="mbta-performance")
 
 app.register_middleware(ConvertToMiddleware(datadog_lambda_wrapper))
 
+# chalicelib imports are deferred to the handlers that need them: pandas and
+# friends dominate cold-start time, so unrelated handlers shouldn't pay for them
+
 
 # Runs every 30 minutes from either 5 AM -> 2:30AM or 6 AM -> 3:30 AM depending on DST
 @app.schedule(Cron("*/30", "0-7,10-23", "*", "*", "?", "*"))
 def process_daily_lamp(event):
+    from chalicelib import lamp
+
     lamp.ingest_today_lamp_data()
+
+
+# Runs at 4:30/5:30 AM, shortly before the first LAMP ingest of the day, so the
+# sqlite GTFS bundle is already built and cached when the ingest runs fire
+@app.schedule(Cron(30, 9, "*", "*", "?", "*"))
+def ensure_gtfs_bundle(event):
+    from chalicelib.date import get_current_service_date
+    from chalicelib.gtfs import ensure_gtfs_bundle_for_date
+
+    ensure_gtfs_bundle_for_date(get_current_service_date())
@@ -1,15 +1,21 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import os
+
 from ..constants import ARCGIS_IDS, HISTORIC_COLUMNS_LAMP, HISTORIC_COLUMNS_PRE_LAMP
 from ..download import download_historic_data, list_files_in_dir, prep_local_dir, unzip_historic_data
 from ..process import process_events
 
+DOWNLOAD_THREADS = 3
 
-def backfill_single_year(year: str):
-    print(f"Backfilling year {year}")
-    # download the data
+
+def download_year(year: str) -> str:
+    """Download and unzip one year of historic data, returning the input dir."""
     zip_file = download_historic_data(year)
-    # unzip the data
-    input_dir = unzip_historic_data(zip_file, f"data/input/{year}")
-    # process the data
+    return unzip_historic_data(zip_file, f"data/input/{year}")
+
+
+def process_year(year: str, input_dir: str):
+    """Process one year of already-downloaded historic data."""
     for file in list_files_in_dir(input_dir):
         # in 2024 data moved to LAMP and the format changed
         if int(year) >= 2024:
@@ -19,13 +25,31 @@ def backfill_single_year(year: str):
     print(f"Finished backfilling year {year}")
 
 
+def backfill_single_year(year: str):
+    print(f"Backfilling year {year}")
+    process_year(year, download_year(year))
+
+
 def backfill_all_years():
     """Backfill all years of MBTA data we can"""
 
     prep_local_dir()
 
-    for year in reversed(ARCGIS_IDS.keys()):
-        backfill_single_year(year)
+    # downloads are network-bound and processing is CPU-bound pandas work, so
+    # prefetch zips on a small thread pool and hand each year off to a process
+    # pool as soon as its download lands: network time hides behind compute
+    years = list(reversed(ARCGIS_IDS.keys()))
+    with (
+        ThreadPoolExecutor(max_workers=DOWNLOAD_THREADS) as downloads,
+        ProcessPoolExecutor(max_workers=min(len(years), os.cpu_count())) as processors,
+    ):
+        download_futures = {downloads.submit(download_year, year): year for year in years}
+        process_futures = []
+        for future in as_completed(download_futures):
+            year = download_futures[future]
+            process_futures.append(processors.submit(process_year, year, future.result()))
+        for future in process_futures:
+            future.result()
 
 
 if __name__ == "__main__":
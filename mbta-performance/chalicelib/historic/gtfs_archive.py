@@ -1,42 +1,144 @@
 import datetime
+import functools
+import numpy as np
 import pandas as pd
 import pathlib
-import shutil
-import urllib.request
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import zipfile
 
 from ..date import to_dateint
+from .download import _SESSION, DOWNLOAD_CHUNK_SIZE
 
 MAIN_DIR = pathlib.Path("./data/gtfs_archives/")
 MAIN_DIR.mkdir(parents=True, exist_ok=True)
 
-ARCHIVES = pd.read_csv("https://cdn.mbta.com/archive/archived_feeds.txt")
+# the archives table is fetched lazily (not at import) and indexed once:
+# sorted start-date arrays let each lookup binary-search instead of running a
+# full boolean mask over the frame per service date
+_archives = None
+_archive_starts = None
+_archive_ends = None
+
+
+def _get_archives() -> pd.DataFrame:
+    global _archives, _archive_starts, _archive_ends
+    if _archives is None:
+        archives = pd.read_csv("https://cdn.mbta.com/archive/archived_feeds.txt")
+        archives = archives.sort_values("feed_start_date", kind="stable", ignore_index=True)
+        _archive_starts = archives.feed_start_date.to_numpy(dtype="int64")
+        _archive_ends = archives.feed_end_date.to_numpy(dtype="int64")
+        _archives = archives
+    return _archives
+
+
+# explicit string types for id-like columns, so arrow neither infers them as
+# ints (dropping leading zeros) nor wastes time inferring at all
+TRIPS_COLUMN_TYPES = {
+    "route_id": pa.string(),
+    "service_id": pa.string(),
+    "trip_id": pa.string(),
+    "trip_headsign": pa.string(),
+    "trip_short_name": pa.string(),
+    "block_id": pa.string(),
+    # int8 to match the events CSVs; merge_asof by-keys are dtype-strict
+    "direction_id": pa.int8(),
+}
+STOP_TIMES_COLUMN_TYPES = {
+    "trip_id": pa.string(),
+    "stop_id": pa.string(),
+    "stop_headsign": pa.string(),
+    "checkpoint_id": pa.string(),
+    # GTFS times can pass 24:00:00, so parse to timedelta in pandas afterwards
+    "arrival_time": pa.string(),
+    "departure_time": pa.string(),
+}
+
+
+def _read_gtfs_member(archive: pathlib.Path, name: str, reader):
+    """Apply a CSV reader to one GTFS file inside an archive.
+
+    The archive is normally the cached zip (members are streamed out without
+    extracting anything to disk), but an already-extracted directory from an
+    older cache still works.
+    """
+    if archive.is_dir():
+        return reader(archive / name)
+    with zipfile.ZipFile(archive) as zip_ref:
+        with zip_ref.open(name) as member:
+            return reader(member)
 
 
-def get_gtfs_archive(dateint: int):
-    """
-    Determine which GTFS archive corresponds to the date.
-    Returns that archive folder, downloading if it doesn't yet exist.
-    """
-    matches = ARCHIVES[(ARCHIVES.feed_start_date <= dateint) & (ARCHIVES.feed_end_date >= dateint)]
-    archive_url = matches.iloc[0].archive_url
+def _read_gtfs_csv(source, column_types: dict) -> pd.DataFrame:
+    """Read one GTFS file on arrow's multithreaded CSV parser."""
+    table = pacsv.read_csv(source, convert_options=pacsv.ConvertOptions(column_types=column_types))
+    return table.to_pandas(self_destruct=True, split_blocks=True)
 
-    archive_name = pathlib.Path(archive_url).stem
 
+@functools.lru_cache(maxsize=64)
+def _materialize_archive(archive_name: str, archive_url: str) -> pathlib.Path:
+    """Return the local archive (cached zip, or legacy extracted folder), downloading if needed.
+
+    Cached on the archive name, so all the service dates that fall in one feed
+    window share a single existence check (or download). Archived feeds are
+    immutable snapshots, so there is no freshness check to make. Only the zip
+    itself is kept: readers pull the handful of files they need straight from
+    it, instead of extracting the whole archive (shapes.txt and friends) to
+    disk.
+    """
     if (MAIN_DIR / archive_name).exists():
-        print(f"Archive for {dateint} already exists: {archive_name}")
+        print(f"Archive already exists: {archive_name}")
         return MAIN_DIR / archive_name
 
-    # else we have to download it
-    print(f"Downloading archive for {dateint}: {archive_url}")
-    zipfile, _ = urllib.request.urlretrieve(archive_url)
-    shutil.unpack_archive(zipfile, extract_dir=(MAIN_DIR / archive_name), format="zip")
-    # remove temporary zipfile
-    urllib.request.urlcleanup()
+    zip_path = MAIN_DIR / f"{archive_name}.zip"
+    if zip_path.exists():
+        print(f"Archive already exists: {zip_path.name}")
+        return zip_path
+
+    # else we have to download it, on the pooled session so backfills reuse
+    # the TLS connection; write through a .part name so an interrupted
+    # download never leaves a truncated zip in the cache
+    print(f"Downloading archive: {archive_url}")
+    part_path = zip_path.with_suffix(".zip.part")
+    with _SESSION.get(archive_url, stream=True, timeout=(10, 300)) as response:
+        response.raise_for_status()
+        with open(part_path, "wb", buffering=DOWNLOAD_CHUNK_SIZE) as f:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+    part_path.replace(zip_path)
 
-    return MAIN_DIR / archive_name
+    return zip_path
 
 
-def get_services(date: datetime.date, archive_dir: pathlib.Path):
+def get_gtfs_archive(dateint: int):
+    """
+    Determine which GTFS archive corresponds to the date.
+    Returns that archive folder, downloading if it doesn't yet exist.
+    """
+    archives = _get_archives()
+
+    # binary-search the last window starting on or before the date; feed
+    # windows can overlap, so fall back to the full scan if it doesn't cover it
+    i = np.searchsorted(_archive_starts, dateint, side="right") - 1
+    if i >= 0 and dateint <= _archive_ends[i]:
+        archive_url = archives.archive_url.iloc[i]
+    else:
+        matches = archives[(archives.feed_start_date <= dateint) & (archives.feed_end_date >= dateint)]
+        archive_url = matches.iloc[0].archive_url
+
+    return _materialize_archive(pathlib.Path(archive_url).stem, archive_url)
+
+
+@functools.lru_cache(maxsize=32)
+def _load_calendar(archive: pathlib.Path):
+    """Load an archive's calendar files once; they're immutable once cached."""
+    return (
+        _read_gtfs_member(archive, "calendar.txt", pd.read_csv),
+        _read_gtfs_member(archive, "calendar_dates.txt", pd.read_csv),
+    )
+
+
+def get_services(date: datetime.date, archive: pathlib.Path):
     """
     Read calendar.txt to determine which services ran on the given date.
     Also, incorporate exceptions from calendar_dates.txt for holidays, etc.
@@ -44,11 +146,10 @@ def get_services(date: datetime.date, archive_dir: pathlib.Path):
     dateint = to_dateint(date)
     day_of_week = date.strftime("%A").lower()
 
-    cal = pd.read_csv(archive_dir / "calendar.txt")
+    cal, exceptions = _load_calendar(archive)
     current_services = cal[(cal.start_date <= dateint) & (cal.end_date >= dateint)]
     services = current_services[current_services[day_of_week] == 1].service_id.tolist()
 
-    exceptions = pd.read_csv(archive_dir / "calendar_dates.txt")
     exceptions = exceptions[exceptions.date == dateint]
     additions = exceptions[exceptions.exception_type == 1].service_id.tolist()
     subtractions = exceptions[exceptions.exception_type == 2].service_id.tolist()
@@ -66,30 +167,21 @@ def read_gtfs(date: datetime.date):
     """
     dateint = to_dateint(date)
 
-    archive_dir = get_gtfs_archive(dateint)
-    services = get_services(date, archive_dir)
-
-    # specify dtypes to avoid warnings
-    trips = pd.read_csv(
-        archive_dir / "trips.txt",
-        dtype={
-            "route_id": str,
-            "service_id": str,
-            "trip_id": str,
-            "trip_headsign": str,
-            "trip_short_name": str,
-            "block_id": str,
-        },
-    )
+    archive = get_gtfs_archive(dateint)
+    services = get_services(date, archive)
+
+    # stop_times.txt is tens of millions of rows; arrow parses it across all
+    # cores where pandas' C parser is single-threaded
+    trips = _read_gtfs_member(archive, "trips.txt", lambda f: _read_gtfs_csv(f, TRIPS_COLUMN_TYPES))
     trips = trips[trips.service_id.isin(services)]
 
-    stops = pd.read_csv(
-        archive_dir / "stop_times.txt",
-        dtype={"trip_id": str, "stop_id": str, "stop_headsign": str, "checkpoint_id": str},
-    )
+    stops = _read_gtfs_member(archive, "stop_times.txt", lambda f: _read_gtfs_csv(f, STOP_TIMES_COLUMN_TYPES))
     stops = stops[stops.trip_id.isin(trips.trip_id)]
-    stops.arrival_time = pd.to_timedelta(stops.arrival_time)
-    stops.departure_time = pd.to_timedelta(stops.departure_time)
+    # HH:MM:SS (possibly past 24:00:00) to int32 seconds after midnight: the
+    # sort/merge keys downstream are then packed ints instead of Timedeltas
+    for col in ("arrival_time", "departure_time"):
+        parts = stops[col].str.split(":", expand=True).astype("int32")
+        stops[col] = (parts[0] * 3600 + parts[1] * 60 + parts[2]).astype("int32")
 
     return trips, stops
 
@@ -120,18 +212,18 @@ def add_gtfs_headways(events_df: pd.DataFrame):
         trip_info = relevant_trips[["trip_id", "route_id", "direction_id"]]
         gtfs_stops = all_stops.merge(trip_info, on="trip_id", how="right")
 
-        # calculate gtfs headways
+        # calculate gtfs headways (arrival_time is int seconds, so diffs and
+        # traveltimes are plain integer arithmetic)
         gtfs_stops = gtfs_stops.sort_values(by="arrival_time")
-        headways = gtfs_stops.groupby(RTE_DIR_STOP).arrival_time.diff()
-        gtfs_stops["scheduled_headway"] = headways.dt.seconds
+        gtfs_stops["scheduled_headway"] = gtfs_stops.groupby(RTE_DIR_STOP).arrival_time.diff()
 
         # calculate gtfs traveltimes
         trip_start_times = gtfs_stops.groupby("trip_id").arrival_time.transform("min")
-        gtfs_stops["scheduled_tt"] = (gtfs_stops.arrival_time - trip_start_times).dt.seconds
+        gtfs_stops["scheduled_tt"] = gtfs_stops.arrival_time - trip_start_times
 
         # assign each actual timepoint a scheduled headway
         # merge_asof 'backward' matches the previous scheduled value of 'arrival_time'
-        days_events["arrival_time"] = days_events.event_time - service_date
+        days_events["arrival_time"] = (days_events.event_time - service_date).dt.total_seconds().astype("int32")
         final = pd.merge_asof(
             days_events.sort_values(by="arrival_time"),
             gtfs_stops[RTE_DIR_STOP + ["arrival_time", "scheduled_headway"]],
@@ -165,6 +257,11 @@ def add_gtfs_headways(events_df: pd.DataFrame):
             suffixes=["", "_gtfs"],
         )
 
+        # arrival_time was flattened to int seconds for the merges above, but
+        # it's written out in the published partitions — convert back to a
+        # timedelta so the csv.gz format stays what consumers already parse
+        final["arrival_time"] = pd.to_timedelta(final["arrival_time"], unit="s")
+
         # finally, put all the days together
         results.append(final)
 
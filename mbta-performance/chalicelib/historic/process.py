@@ -1,59 +1,155 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import numpy as np
+import os
 import pandas as pd
-import pathlib
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+try:
+    # ISA-L's SIMD deflate is severalfold faster than zlib at similar ratios
+    from isal import igzip as gzip
+except ImportError:
+    import gzip
 from .constants import HISTORIC_COLUMNS_PRE_LAMP as HISTORIC_COLUMNS
 from .gtfs_archive import add_gtfs_headways
 
+# bytes per block when streaming an input CSV; keeps peak memory O(block)
+# rather than O(file) on the multi-GB yearly dumps
+BLOCK_SIZE = 64 << 20
 
-def process_events(input_csv: str, outdir: str, nozip: bool = False, columns: list = HISTORIC_COLUMNS):
-    df = pd.read_csv(
+# explicit column types so arrow skips inference and ids keep leading zeros
+CSV_COLUMN_TYPES = {
+    "service_date": pa.timestamp("s"),
+    "route_id": pa.string(),
+    "trip_id": pa.string(),
+    "direction_id": pa.int8(),
+    "stop_id": pa.string(),
+    "stop_sequence": pa.int16(),
+    "sync_stop_sequence": pa.int16(),
+    "vehicle_id": pa.string(),
+    "vehicle_label": pa.string(),
+    "event_type": pa.string(),
+    "event_time_sec": pa.int32(),
+}
+
+
+def _read_csv_chunks(input_csv: str, columns: list):
+    """Stream a CSV as pandas chunks via arrow's multithreaded parser."""
+    # tell the kernel we're about to scan the file front to back so readahead
+    # starts before the parser asks for the first block (Linux only)
+    if hasattr(os, "posix_fadvise"):
+        fd = os.open(input_csv, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    reader = pacsv.open_csv(
         input_csv,
-        usecols=columns,
-        parse_dates=["service_date"],
-        dtype={
-            "route_id": "str",
-            "trip_id": "str",
-            "stop_id": "str",
-            "vehicle_id": "str",
-            "vehicle_label": "str",
-            "event_time": "int",
-        },
+        read_options=pacsv.ReadOptions(block_size=BLOCK_SIZE),
+        convert_options=pacsv.ConvertOptions(include_columns=columns, column_types=CSV_COLUMN_TYPES),
     )
+    with reader:
+        for batch in reader:
+            yield pa.Table.from_batches([batch]).to_pandas(self_destruct=True, split_blocks=True)
+
 
-    df["event_time"] = df["service_date"] + pd.to_timedelta(df["event_time_sec"], unit="s")
-    df.drop(columns=["event_time_sec"], inplace=True)
+def process_events(input_csv: str, outdir: str, nozip: bool = False, columns: list = HISTORIC_COLUMNS):
+    # stream the file chunk-by-chunk; the first chunk touching a partition file
+    # overwrites it and later chunks append, so reruns stay idempotent
+    written_files = set()
+    # whether GTFS benchmarks are being added, decided by the first chunk and
+    # then enforced: every chunk appended to a partition must carry the same
+    # columns, so enrichment has to be all-or-nothing per input file
+    enrich = None
+    for df in _read_csv_chunks(input_csv, columns):
+        # add the seconds directly on the numpy datetime64[s] buffers: one
+        # vectorized add, no intermediate pandas timedelta allocation
+        df["event_time"] = df["service_date"].to_numpy() + df["event_time_sec"].to_numpy().astype("timedelta64[s]")
+        df.drop(columns=["event_time_sec"], inplace=True)
 
-    if "sync_stop_sequence" in df.columns:
-        df.rename(columns={"sync_stop_sequence": "stop_sequence"}, inplace=True)
+        if "sync_stop_sequence" in df.columns:
+            df.rename(columns={"sync_stop_sequence": "stop_sequence"}, inplace=True)
 
-    try:
-        df = add_gtfs_headways(df)
-    except IndexError:
-        # failure to add gtfs benchmarks
-        pass
+        if enrich is None or enrich:
+            try:
+                df = add_gtfs_headways(df)
+                enrich = True
+            except IndexError:
+                # failure to add gtfs benchmarks
+                if enrich:
+                    # earlier chunks were enriched; appending rows without the
+                    # benchmark columns would corrupt the partition files
+                    raise
+                enrich = False
 
-    # Write to disk
-    to_disk(df, outdir, nozip)
+        # Write to disk
+        to_disk(df, outdir, nozip, written_files=written_files)
 
 
-def to_disk(df: pd.DataFrame, outdir, nozip=False):
+def to_disk(df: pd.DataFrame, outdir, nozip=False, written_files=None):
     """
     For each service_date/stop_id/direction/route group, we write the events to disk.
+
+    When written_files is given, files it already contains are appended to
+    (without a header) rather than overwritten, so a chunked caller can stream
+    into the same partitions.
     """
-    service_date_month = pd.Grouper(key="service_date", freq="1ME")
-    grouped = df.groupby([service_date_month, "stop_id"])
+    # categorical keys make the groupby hash int codes instead of Python
+    # strings, and the low-cardinality label columns serialize without
+    # per-value object dispatch; observed=True keeps the original behavior of
+    # only emitting (month, stop) pairs that actually have events.
+    # trip_id stays plain: it's near-unique per chunk, so a dictionary would
+    # cost more to build than it saves
+    for col in ("route_id", "stop_id", "direction_id", "event_type", "vehicle_id", "vehicle_label"):
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    # group on months-since-epoch ints instead of a pd.Grouper resample key:
+    # the astype/view is a single vectorized truncation, with no DatetimeIndex
+    # materialized and no need for sorted month buckets (sort=False)
+    month_key = df["service_date"].to_numpy().astype("datetime64[M]").view("i8")
+
+    # one stable sort on the partition key up front makes every group a
+    # contiguous row range, so building each partition frame is a sequential
+    # slice instead of a scattered gather
+    order = np.lexsort((df["stop_id"].cat.codes.to_numpy(), month_key))
+    df = df.take(order)
+    month_key = month_key[order]
+    grouped = df.groupby([month_key, "stop_id"], sort=False, observed=True)
 
+    # collect the partitions and pre-create their directories, then write them
+    # on a thread pool: gzip compression happens in zlib's C code with the GIL
+    # released, so independent partition writes genuinely run in parallel
+    writes = []
+    seen_dirs = set()
     for name, events in grouped:
-        service_date, stop_id = name
-
-        fname = pathlib.Path(
-            outdir,
-            "Events",
-            "monthly-data",
-            str(stop_id),
-            f"Year={service_date.year}",
-            f"Month={service_date.month}",
-            "events.csv.gz",
-        )
-        fname.parent.mkdir(parents=True, exist_ok=True)
+        months, stop_id = name
+        year, month = divmod(months, 12)
+
+        # plain string joins and a seen-directory cache: pathlib allocation and
+        # repeated mkdir walks add up over tens of thousands of groups
+        parent = f"{outdir}/Events/monthly-data/{stop_id}/Year={year + 1970}/Month={month + 1}"
+        if parent not in seen_dirs:
+            os.makedirs(parent, exist_ok=True)
+            seen_dirs.add(parent)
+        fname = f"{parent}/events.csv.gz"
+        first_write = written_files is None or fname not in written_files
+        if written_files is not None:
+            written_files.add(fname)
+        writes.append((fname, events, first_write))
+
+    def _write_partition(write):
+        fname, events, first_write = write
+        if nozip:
+            # compression=None: pandas would otherwise infer gzip from the
+            # .csv.gz suffix and compress despite the flag
+            events.to_csv(fname, index=False, compression=None, mode="w" if first_write else "a", header=first_write)
+            return
         # set mtime to 0 in gzip header for determinism (so we can re-gen old routes, and rsync to s3 will ignore)
-        events.to_csv(fname, index=False, compression={"method": "gzip", "mtime": 0} if not nozip else None)
+        with gzip.GzipFile(fname, "wb" if first_write else "ab", mtime=0) as gz:
+            with io.TextIOWrapper(gz, encoding="utf-8", newline="") as buffer:
+                events.to_csv(buffer, index=False, header=first_write)
+
+    with ThreadPoolExecutor(max_workers=min(8, os.cpu_count())) as executor:
+        for _ in executor.map(_write_partition, writes):
+            pass
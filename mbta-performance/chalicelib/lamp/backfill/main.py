@@ -1,13 +1,19 @@
-import pandas as pd
-from ..ingest import fetch_pq_file_from_remote, ingest_pq_file, upload_to_s3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from ..ingest import fetch_lamp_index, fetch_pq_file_from_remote, ingest_pq_file, upload_to_s3
 from ... import parallel
 from datetime import date, timedelta
 
 
-_parallel_upload = parallel.make_parallel(upload_to_s3)
+_parallel_upload = parallel.make_parallel(upload_to_s3, THREAD_COUNT=16)
 
 EARLIEST_LAMP_DATA = date(2019, 9, 15)
 
+# dates fetched ahead of the one being processed; bounds how many daily
+# frames are held in memory at once
+PREFETCH_DEPTH = 4
+
 
 def backfill_all_in_index():
     """Backfill all the dates in the LAMP index."""
@@ -19,23 +25,49 @@ def backfill_all_in_index():
         print("You must enter 'yes' to proceed. Exiting.")
         exit(1)
 
-    # all dates that LAMP has data for, starting from 2019-09-15
-    dates = pd.date_range(EARLIEST_LAMP_DATA, date.today() - timedelta(days=1), freq="d")
-
-    # Backfill each date, most recent to oldest
-    for backfill_timestamp in dates[::-1]:
-        date_to_backfill = backfill_timestamp.date()
-        try:
-            pq_df = fetch_pq_file_from_remote(date_to_backfill)
-        except ValueError as e:
-            # If we can't fetch the file, we can't process it
-            print(f"Failed to fetch {date_to_backfill}: {e}")
-        print(f"Processing {date_to_backfill}")
-        processed_daily_events = ingest_pq_file(pq_df, date_to_backfill)
-
-        # split daily events by stop_id and parallel upload to s3
-        stop_event_groups = processed_daily_events.groupby("stop_id")
-        _parallel_upload(stop_event_groups, date_to_backfill)
+    # all dates that LAMP has data for, starting from 2019-09-15 — plain date
+    # arithmetic, no Timestamp index to build and convert back per day
+    last_date = date.today() - timedelta(days=1)
+    num_days = (last_date - EARLIEST_LAMP_DATA).days
+
+    # Backfill each date, most recent to oldest. Fetches are network-bound and
+    # ingest is CPU-bound pandas work, so a small thread pool downloads the
+    # next few days' files while the current one is processed; the deque keeps
+    # at most PREFETCH_DEPTH frames in flight
+    dates_to_backfill = [EARLIEST_LAMP_DATA + timedelta(days=i) for i in range(num_days, -1, -1)]
+
+    # one index fetch up front lets us skip dates LAMP never published,
+    # instead of paying a failed GET for each one
+    try:
+        index = fetch_lamp_index()
+        dates_to_backfill = [d for d in dates_to_backfill if d.strftime("%Y-%m-%d") in index]
+    except requests.RequestException as e:
+        print(f"Failed to fetch LAMP index, trying all dates: {e}")
+
+    with ThreadPoolExecutor(max_workers=PREFETCH_DEPTH) as fetchers:
+        fetches = deque(
+            (date_to_backfill, fetchers.submit(fetch_pq_file_from_remote, date_to_backfill))
+            for date_to_backfill in dates_to_backfill[:PREFETCH_DEPTH]
+        )
+        next_index = len(fetches)
+        while fetches:
+            date_to_backfill, fetch = fetches.popleft()
+            if next_index < len(dates_to_backfill):
+                next_date = dates_to_backfill[next_index]
+                fetches.append((next_date, fetchers.submit(fetch_pq_file_from_remote, next_date)))
+                next_index += 1
+            try:
+                pq_df = fetch.result()
+            except ValueError as e:
+                # If we can't fetch the file, we can't process it
+                print(f"Failed to fetch {date_to_backfill}: {e}")
+                continue
+            print(f"Processing {date_to_backfill}")
+            processed_daily_events = ingest_pq_file(pq_df, date_to_backfill)
+
+            # split daily events by stop_id and parallel upload to s3
+            stop_event_groups = processed_daily_events.groupby("stop_id")
+            _parallel_upload(stop_event_groups, date_to_backfill)
 
 
 if __name__ == "__main__":
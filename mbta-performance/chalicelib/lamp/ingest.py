@@ -1,11 +1,12 @@
 from datetime import date
-import io
+import numpy as np
 import pandas as pd
 import requests
+import tempfile
 from typing import Tuple
 
 from .constants import LAMP_COLUMNS, S3_COLUMNS, STOP_ID_NUMERIC_MAP
-from ..date import format_dateint, get_current_service_date, EASTERN_TIME
+from ..date import get_current_service_date, EASTERN_TIME
 from ..gtfs import fetch_stop_times_from_gtfs
 
 from .. import parallel
@@ -27,11 +28,15 @@ COLUMN_RENAME_MAP = {
 # if a trip_id begins with NONREV-, it is not revenue producing and thus not something we want to benchmark
 # but only if it happens before December 2023 as it's an unreliable indicator of actual revenue service.
 # All trips after that are properly ignored by the LAMP system, and don't appear in the dataset anymore.
-TRIP_IDS_TO_DROP = ("NONREV-",)
+NONREV_CUTOFF_DATEINT = 20231130
 
 # defining these columns in particular becasue we use them everywhere
 RTE_DIR_STOP = ["route_id", "direction_id", "stop_id"]
 
+# parquet downloads spill to a temp file past this size; daily files fit in memory
+SPOOL_SIZE = 64 << 20
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
 
 def _local_save(s3_key, stop_events):
     """TODO remove this temp code, it saves the output files locally!"""
@@ -65,64 +70,93 @@ def _process_arrival_departure_times(pq_df: pd.DataFrame) -> pd.DataFrame:
     """
     pq_df["dep_time"] = pd.to_datetime(pq_df["move_timestamp"], unit="s", utc=True).dt.tz_convert(EASTERN_TIME)
     pq_df["arr_time"] = pd.to_datetime(pq_df["stop_timestamp"], unit="s", utc=True).dt.tz_convert(EASTERN_TIME)
-    pq_df = pq_df.sort_values(by=["stop_sequence"])
-
-    # explode departure and arrival times
-    arr_df = pq_df[pq_df["arr_time"].notna()]
-    arr_df = arr_df.assign(event_type="ARR").rename(columns={"arr_time": "event_time"})
-    arr_df = arr_df[S3_COLUMNS]
-
-    dep_df = pq_df[pq_df["dep_time"].notna()]
-    dep_df = dep_df.assign(event_type="DEP").rename(columns={"dep_time": "event_time"})
+    # stable sort so tied stop_sequences keep their order within a trip
+    pq_df = pq_df.sort_values(by=["stop_sequence"], kind="stable")
 
     # these departures are from the the previous stop! so set them to the previous stop id
-    # find the stop id for the departure whose sequence number precences the recorded one
-    # stop sequences don't necessarily increment by 1 or with a reliable pattern
-    dep_df = pd.merge_asof(
-        dep_df,
-        arr_df,
-        on=["stop_sequence"],
-        by=[
-            "service_date",  # comment out for faster performance
-            "route_id",
-            "trip_id",
-            "vehicle_id",
-            "direction_id",
-        ],
-        direction="backward",
-        suffixes=("_curr", "_prev"),
-        allow_exact_matches=False,  # don't want to match on itself
-    )
-
-    # use current infomation for almost everything...
-    renamed_cols = {key + "_curr": key for key in S3_COLUMNS if key != "stop_id"}
-    # ...but use the PREVIOUS stop_id
-    renamed_cols["stop_id_prev"] = "stop_id"
-    dep_df = dep_df.rename(columns=renamed_cols)[S3_COLUMNS]
-
-    # stitch together arrivals and departures
-    return pd.concat([arr_df, dep_df])
+    # stop sequences don't necessarily increment by 1 or with a reliable pattern, so
+    # "previous" means the trip's latest arrival earlier in the sequence: a
+    # groupwise shift+ffill over the sorted frame, which matches each departure
+    # in one C pass instead of a five-key merge_asof building (and mostly
+    # discarding) a suffixed join of every column
+    trip_keys = [
+        "service_date",
+        "route_id",
+        "trip_id",
+        "vehicle_id",
+        "direction_id",
+    ]
+    pq_df["_prev_arr_stop"] = pq_df["stop_id"].where(pq_df["arr_time"].notna())
+    pq_df["_prev_arr_stop"] = pq_df.groupby(trip_keys, sort=False, observed=True)["_prev_arr_stop"].shift(1)
+    pq_df["_prev_arr_stop"] = pq_df.groupby(trip_keys, sort=False, observed=True)["_prev_arr_stop"].ffill()
+
+    # explode departure and arrival times: one positional gather stacks the
+    # arrival rows over the departure rows, and event_type/event_time/stop_id
+    # are then single positional column writes — no per-half projected copies
+    # and no concat of two frames
+    arr_pos = np.flatnonzero(pq_df["arr_time"].notna().to_numpy())
+    dep_pos = np.flatnonzero(pq_df["dep_time"].notna().to_numpy())
+
+    events = pq_df.take(np.concatenate([arr_pos, dep_pos]))
+    events["event_type"] = np.repeat(["ARR", "DEP"], [len(arr_pos), len(dep_pos)])
+    events["event_time"] = pd.concat([pq_df["arr_time"].take(arr_pos), pq_df["dep_time"].take(dep_pos)]).array
+    events["stop_id"] = pd.concat([pq_df["stop_id"].take(arr_pos), pq_df["_prev_arr_stop"].take(dep_pos)]).array
+
+    return events[S3_COLUMNS]
+
+
+def fetch_lamp_index() -> str:
+    """Fetch the LAMP index listing every published parquet file."""
+    result = requests.get(LAMP_INDEX_URL)
+    result.raise_for_status()
+    return result.text
 
 
 def fetch_pq_file_from_remote(service_date: date) -> pd.DataFrame:
     """Fetch a parquet file from LAMP for a given service date."""
-    # TODO(check if file exists in index, throw if it doesn't)
     url = RAPID_DAILY_URL_TEMPLATE.format(YYYY_MM_DD=service_date.strftime("%Y-%m-%d"))
-    result = requests.get(url)
-
-    if result.status_code != 200:
-        raise ValueError(f"Failed to fetch LAMP parquet file from {url}. Status code: {result.status_code}")
-
-    return pd.read_parquet(
-        io.BytesIO(result.content),
+    # stream the body into one spooled buffer instead of materializing
+    # result.content and then copying it into a BytesIO: the compressed file
+    # is held once, and anything over SPOOL_SIZE spills to disk
+    buffer = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    with requests.get(url, stream=True) as result:
+        if result.status_code != 200:
+            raise ValueError(f"Failed to fetch LAMP parquet file from {url}. Status code: {result.status_code}")
+        for chunk in result.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            buffer.write(chunk)
+    buffer.seek(0)
+
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    pq_df = pd.read_parquet(
+        buffer,
         columns=LAMP_COLUMNS,
         engine="pyarrow",
+        # push the non-revenue filter into the parquet read so those rows are
+        # never decoded or materialized (see NONREV_CUTOFF_DATEINT above)
+        filters=~(pc.starts_with(ds.field("trip_id"), "NONREV-") & (ds.field("service_date") < NONREV_CUTOFF_DATEINT)),
         # NB: Even through parquet files are compressed with columnar metadata, pandas will sometimes override them
         # if the columns contain nulls. This is important as the move/stop times are nullable int64 epoch timestamps,
         # which will overflow if read in as floats.
         # https://pandas.pydata.org/docs/user_guide/integer_na.html#nullable-integer-data-type
         dtype_backend="numpy_nullable",
     )
+    # the benchmark columns are second counts that comfortably fit in 32 bits;
+    # halving their width halves the bytes every downstream sort/group/merge
+    # moves. The epoch timestamp columns stay Int64 (see overflow note above)
+    return pq_df.astype(
+        {
+            "travel_time_seconds": "Int32",
+            "dwell_time_seconds": "Int32",
+            "headway_trunk_seconds": "Int32",
+            "headway_branch_seconds": "Int32",
+            "scheduled_travel_time": "Int32",
+            "scheduled_headway_trunk": "Int32",
+            "scheduled_headway_branch": "Int32",
+        },
+        copy=False,
+    )
 
 
 def _recalculate_fields_from_gtfs(pq_df: pd.DataFrame, service_date: date):
@@ -136,12 +170,12 @@ def _recalculate_fields_from_gtfs(pq_df: pd.DataFrame, service_date: date):
 
     # we could do this groupby/min/merge in sql, but let's keep our computations in
     # pandas to stay consistent across services
-    trip_start_times = gtfs_stops.groupby("trip_id").arrival_time.transform("min")
+    trip_start_times = gtfs_stops.groupby("trip_id", observed=True).arrival_time.transform("min")
     gtfs_stops["scheduled_tt"] = gtfs_stops["arrival_time"] - trip_start_times
     gtfs_stops["arrival_time"] = gtfs_stops["arrival_time"].astype(float)
 
     # assign each actual trip a scheduled trip_id, based on when it started the route
-    route_starts = pq_df.loc[pq_df.groupby("trip_id").event_time.idxmin()]
+    route_starts = pq_df.loc[pq_df.groupby("trip_id", observed=True).event_time.idxmin()]
     route_starts["arrival_time"] = (
         route_starts.event_time - pd.Timestamp(service_date).tz_localize(EASTERN_TIME)
     ).dt.total_seconds()
@@ -201,16 +235,25 @@ def _average_scheduled_headways(pq_df: pd.DataFrame, service_date: date) -> pd.D
 def ingest_pq_file(pq_df: pd.DataFrame, service_date: date) -> pd.DataFrame:
     """Process and tranform columns for the full day's events."""
     pq_df["direction_id"] = pq_df["direction_id"].astype("int16")
-    pq_df["service_date"] = pq_df["service_date"].apply(format_dateint)
+    # vectorized YYYYMMDD -> YYYY-MM-DD (one C parse instead of a Python
+    # strptime/strftime round trip per row)
+    pq_df["service_date"] = pd.to_datetime(pq_df["service_date"], format="%Y%m%d").dt.strftime("%Y-%m-%d")
     # use trunk headway metrics as default, and add branch metrics when it makes sense.
     # TODO: verify and recalculate headway metrics if necessary!
     pq_df = pq_df.rename(columns=COLUMN_RENAME_MAP)
     # Live data will sometimes report an aliased version of stop_id different
     # from that which GTFS reports in its schedule. Replace for better schedule matching.
-    pq_df["stop_id"] = pq_df["stop_id"].replace(STOP_ID_NUMERIC_MAP)
-    # drop non-revenue producing events
-    cutoff_date = format_dateint(20231130)
-    pq_df = pq_df[~((pq_df["trip_id"].str.startswith(TRIP_IDS_TO_DROP)) & (pq_df["service_date"] < cutoff_date))]
+    # map+fillna runs one hashed C lookup per row, where replace can fall back
+    # to slower per-element matching
+    # (.map returns object dtype, so cast back for the later dtype-strict merges)
+    pq_df["stop_id"] = pq_df["stop_id"].map(STOP_ID_NUMERIC_MAP).fillna(pq_df["stop_id"]).astype(pq_df["stop_id"].dtype)
+    # categorical-encode the repetitive group keys so the groupbys below hash
+    # int codes instead of strings. route/direction/stop stay plain: they're
+    # merge_asof by-keys against the GTFS frame and those dtypes must match
+    for col in ("service_date", "trip_id", "vehicle_id"):
+        pq_df[col] = pq_df[col].astype("category")
+    # non-revenue events from before the cutoff were already filtered out at
+    # parquet-read time in fetch_pq_file_from_remote
 
     processed_daily_events = _process_arrival_departure_times(pq_df)
     processed_daily_events = processed_daily_events[processed_daily_events["stop_id"].notna()]
@@ -238,7 +281,7 @@ def upload_to_s3(stop_id_and_events: Tuple[str, pd.DataFrame], service_date: dat
     return [stop_id]
 
 
-_parallel_upload = parallel.make_parallel(upload_to_s3)
+_parallel_upload = parallel.make_parallel(upload_to_s3, THREAD_COUNT=16)
 
 
 def ingest_today_lamp_data():
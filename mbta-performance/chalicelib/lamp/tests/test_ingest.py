@@ -8,6 +8,7 @@ import pandas as pd
 
 from .. import ingest
 from .. import constants
+from ... import gtfs
 
 # The sample file attached here is 10k events sampled from Feb 7th, 2024.
 # These rows contain real-world inconsistencies in their data!
@@ -21,12 +22,18 @@ class TestIngest(unittest.TestCase):
         with open(SAMPLE_LAMP_DATA_PATH, "rb") as f:
             self.data = f.read()
 
-        self.mock_gtfs_data = pd.read_csv(
-            SAMPLE_GTFS_DATA_PATH,
-            dtype_backend="numpy_nullable",
-            dtype={"direction_id": "int16"},
+        # build the mock through the same frame constructor production uses,
+        # so its dtypes can't drift from what fetch_stop_times_from_gtfs returns
+        raw_gtfs = pd.read_csv(SAMPLE_GTFS_DATA_PATH)
+        self.mock_gtfs_data = gtfs._build_stop_times_frame(
+            {
+                "trip_id": raw_gtfs["trip_id"].astype(str).tolist(),
+                "stop_id": raw_gtfs["stop_id"].astype(str).tolist(),
+                "arrival_time": raw_gtfs["arrival_time"].tolist(),
+                "route_id": raw_gtfs["route_id"].tolist(),
+                "direction_id": raw_gtfs["direction_id"].astype(str).tolist(),
+            }
         )
-        self.mock_gtfs_data["direction_id"] = self.mock_gtfs_data["direction_id"].astype("int16")
 
     def _mock_s3_upload(self):
         # mock upload of s3.upload_df_as_csv() to a fake bucket
@@ -58,7 +65,9 @@ class TestIngest(unittest.TestCase):
         self.assertEqual(len(bad_late_arrivals), 8)
 
     def test_fetch_pq_file_from_remote(self):
-        mock_response = mock.Mock(status_code=200, content=self.data)
+        mock_response = mock.MagicMock(status_code=200)
+        mock_response.__enter__.return_value = mock_response
+        mock_response.iter_content.return_value = iter([self.data])
         with mock.patch("requests.get", return_value=mock_response):
             inital_df = ingest.fetch_pq_file_from_remote(date(2024, 2, 7))
             self.assertListEqual(
@@ -74,13 +83,13 @@ class TestIngest(unittest.TestCase):
                     "string[python]",  # vehicle_label
                     pd.Int64Dtype(),  # move_timestamp
                     pd.Int64Dtype(),  # stop_timestamp
-                    pd.Int64Dtype(),
-                    pd.Int64Dtype(),
-                    pd.Int64Dtype(),
-                    pd.Int64Dtype(),
-                    pd.Int64Dtype(),
-                    pd.Int64Dtype(),
-                    pd.Int64Dtype(),
+                    pd.Int32Dtype(),  # travel_time_seconds
+                    pd.Int32Dtype(),  # dwell_time_seconds
+                    pd.Int32Dtype(),  # headway_trunk_seconds
+                    pd.Int32Dtype(),  # headway_branch_seconds
+                    pd.Int32Dtype(),  # scheduled_travel_time
+                    pd.Int32Dtype(),  # scheduled_headway_trunk
+                    pd.Int32Dtype(),  # scheduled_headway_branch
                 ],
             )
 
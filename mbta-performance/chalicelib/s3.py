@@ -1,10 +1,13 @@
 import boto3
+from botocore.config import Config
 import io
 import pandas as pd
 import zlib
 import time
 
-s3 = boto3.client("s3")
+# pool sized to match the parallel per-stop uploads so no thread waits for a
+# free connection
+s3 = boto3.client("s3", config=Config(max_pool_connections=16, tcp_keepalive=True))
 cloudfront = boto3.client("cloudfront")
 
 